@@ -2,6 +2,8 @@ import type { NextConfig } from "next";
 
 const nextConfig: NextConfig = {
   /* config options here */
+  // gzip API responses and public/*.json city data (on by default; keep it explicit)
+  compress: true,
 };
 
 export default nextConfig;
@@ -1,111 +1,149 @@
-import { subdivideQuad, closePolygon, toGoogleFormat, Point } from '@/lib/subdivision';
+import { subdivideQuad, Point } from '@/lib/subdivision';
 import { NextRequest, NextResponse } from 'next/server';
-import { PLACE_TYPES } from '@/config/filters';
+import { getCount, getPlaceIds, flushInsightsCache } from '@/lib/insights';
+import { hydratePlace, placeDetailsCache, PlaceDetails } from '@/lib/places';
+import { MAX_CONCURRENT_REQUESTS } from '@/lib/google';
+import { createLimiter } from '@/lib/concurrency';
 
 const THRESHOLD = 100;
+const DEFAULT_MAX_API_CALLS = 500;
+
+type Tile = { polygon: Point[]; count: number };
+
+// Splitting a tile costs 4 INSIGHT_COUNT calls and turns its own pending
+// INSIGHT_PLACES call into up to 4, so it needs 7 calls of headroom
+const SPLIT_COST = 7;
+
+/**
+ * Walks the quadtree one level at a time, issuing every call in a level concurrently.
+ *
+ * `maxApiCalls` is a hard cap on Google calls, including the root INSIGHT_COUNT
+ * when `count` is not given. Every tile in the frontier keeps one INSIGHT_PLACES
+ * call reserved, and tiles over THRESHOLD are split (largest count first) only
+ * while the remaining budget covers SPLIT_COST. Tiles that can't be split get
+ * INSIGHT_PLACES as-is (capped at 100 results each) and the result is flagged
+ * as truncated.
+ *
+ * `onNewIds` is called with each place ID the first time it is seen, as soon as
+ * its tile returns, so callers can start work before collection finishes.
+ */
+async function collectPlaces(
+  polygon: Point[],
+  count: number | undefined,
+  apiKey: string,
+  maxApiCalls: number,
+  onNewIds?: (placeIds: string[]) => void
+): Promise<{ placeIds: string[]; truncated: boolean }> {
+  const allPlaceIds = new Set<string>();
+  let apiCalls = 0;
+
+  // Count the root polygon ourselves if the caller didn't pass one
+  if (count === undefined) {
+    count = await getCount(polygon, apiKey);
+    apiCalls++;
+  }
+  console.log(`Starting collection for polygon with initial count: ${count}`);
 
-async function getCount(polygon: Point[], apiKey: string): Promise<number> {
-  const closedPolygon = closePolygon(polygon);
-
-  const requestBody = {
-    insights: ['INSIGHT_COUNT'],
-    filter: {
-      locationFilter: {
-        customArea: {
-          polygon: {
-            coordinates: toGoogleFormat(closedPolygon)
-          }
-        }
-      },
-      typeFilter: { includedTypes: PLACE_TYPES },
-      ratingFilter: { minRating: 4.5, maxRating: 5.0 },
-      operatingStatus: ['OPERATING_STATUS_OPERATIONAL']
-    }
-  };
+  let frontier: Tile[] = count > 0 ? [{ polygon, count }] : [];
+  let depth = 0;
+  let truncated = false;
 
-  const response = await fetch('https://areainsights.googleapis.com/v1:computeInsights', {
-    method: 'POST',
-    headers: {
-      'Content-Type': 'application/json',
-      'X-Goog-Api-Key': apiKey
-    },
-    body: JSON.stringify(requestBody)
-  });
+  const addPlaceIds = (placeIds: string[]) => {
+    const newIds = placeIds.filter(id => !allPlaceIds.has(id));
+    for (const id of newIds) allPlaceIds.add(id);
+    if (onNewIds && newIds.length > 0) onNewIds(newIds);
+  };
 
-  if (!response.ok) {
-    const errorText = await response.text();
-    throw new Error(`Google API error: ${response.status} - ${errorText}`);
+  while (frontier.length > 0) {
+    console.log(`Level ${depth}: processing ${frontier.length} polygons (${apiCalls} API calls so far)`);
+
+    const leaves = frontier.filter(tile => tile.count <= THRESHOLD);
+    const oversized = frontier
+      .filter(tile => tile.count > THRESHOLD)
+      .sort((a, b) => b.count - a.count);
+
+    // Budget left after reserving one INSIGHT_PLACES call per frontier tile
+    let headroom = maxApiCalls - apiCalls - frontier.length;
+    const toSplit: Tile[] = [];
+    for (const tile of oversized) {
+      if (headroom >= SPLIT_COST) {
+        toSplit.push(tile);
+        headroom -= SPLIT_COST;
+      } else {
+        leaves.push(tile);
+        truncated = true;
+      }
+    }
+    if (toSplit.length < oversized.length) {
+      console.log(`API call budget of ${maxApiCalls} reached, fetching ${oversized.length - toSplit.length} polygons without splitting`);
+    }
+    apiCalls += leaves.length + 4 * toSplit.length;
+
+    // Small enough tiles get place IDs directly; the rest are subdivided into
+    // 4 quadrants which are counted in the same wave
+    const quadrants = toSplit.flatMap(tile => subdivideQuad(tile.polygon));
+    const [, counts] = await Promise.all([
+      Promise.all(leaves.map(tile => getPlaceIds(tile.polygon, apiKey).then(addPlaceIds))),
+      Promise.all(quadrants.map(quad => getCount(quad, apiKey)))
+    ]);
+
+    // Empty quadrants need no INSIGHT_PLACES call or further splitting. In sparse
+    // areas this usually leaves one child holding all of its parent's count
+    frontier = quadrants
+      .map((quad, i) => ({ polygon: quad, count: counts[i] }))
+      .filter(tile => tile.count > 0);
+    const pruned = quadrants.length - frontier.length;
+    if (pruned > 0) {
+      console.log(`Pruned ${pruned} empty quadrants`);
+    }
+    depth++;
   }
 
-  const data = await response.json();
-  return parseInt(data.count || '0');
+  return { placeIds: [...allPlaceIds], truncated };
 }
 
-async function getPlaceIds(polygon: Point[], apiKey: string): Promise<string[]> {
-  const closedPolygon = closePolygon(polygon);
-
-  const requestBody = {
-    insights: ['INSIGHT_PLACES'],
-    filter: {
-      locationFilter: {
-        customArea: {
-          polygon: {
-            coordinates: toGoogleFormat(closedPolygon)
-          }
+/**
+ * Hydrates place IDs as they are collected. New Place Details calls stop being
+ * dispatched after a 429 or once `state.stopped` is set; calls already in flight
+ * are left to finish.
+ */
+function createHydrationQueue(apiKey: string) {
+  const limit = createLimiter(MAX_CONCURRENT_REQUESTS);
+  const pending: Promise<PlaceDetails | null>[] = [];
+  const state = { rateLimitHit: false, stopped: false };
+
+  const hydrateOne = async (placeId: string): Promise<PlaceDetails | null> => {
+    const cached = await placeDetailsCache.get(placeId);
+    if (cached) return cached;
+
+    // Flags are checked once a slot frees up, so queued places are skipped too
+    return limit(async () => {
+      if (state.rateLimitHit || state.stopped) return null;
+      try {
+        return await hydratePlace(placeId, apiKey);
+      } catch {
+        // hydratePlace only rethrows rate limit errors
+        if (!state.rateLimitHit) {
+          console.log(`Rate limit detected (429 error), stopping hydration process`);
         }
-      },
-      typeFilter: { includedTypes: PLACE_TYPES },
-      ratingFilter: { minRating: 4.5, maxRating: 5.0 },
-      operatingStatus: ['OPERATING_STATUS_OPERATIONAL']
-    }
+        state.rateLimitHit = true;
+        return null;
+      }
+    });
   };
 
-  const response = await fetch('https://areainsights.googleapis.com/v1:computeInsights', {
-    method: 'POST',
-    headers: {
-      'Content-Type': 'application/json',
-      'X-Goog-Api-Key': apiKey
+  return {
+    state,
+    add: (placeIds: string[]) => {
+      for (const id of placeIds) pending.push(hydrateOne(id));
     },
-    body: JSON.stringify(requestBody)
-  });
-
-  if (!response.ok) {
-    const errorText = await response.text();
-    throw new Error(`Google API error: ${response.status} - ${errorText}`);
-  }
-
-  const data = await response.json();
-  // Extract place IDs from the response
-  const placeInfos = data.placeInfos || [];
-  return placeInfos.map((info: { place: string }) => info.place);
-}
-
-async function collectPlacesRecursive(
-  polygon: Point[],
-  count: number,
-  apiKey: string
-): Promise<string[]> {
-  console.log(`Processing polygon with count: ${count}`);
-
-  if (count <= THRESHOLD) {
-    // Small enough - get place IDs directly
-    console.log(`Count <= ${THRESHOLD}, fetching place IDs...`);
-    return getPlaceIds(polygon, apiKey);
-  }
-
-  // Too many - subdivide into 4 quadrants
-  console.log(`Count > ${THRESHOLD}, subdividing...`);
-  const quadrants = subdivideQuad(polygon);
-  const allPlaceIds: string[] = [];
-
-  for (const quad of quadrants) {
-    const quadCount = await getCount(quad, apiKey);
-    const placeIds = await collectPlacesRecursive(quad, quadCount, apiKey);
-    allPlaceIds.push(...placeIds);
-  }
-
-  // Dedupe in case of overlap
-  return [...new Set(allPlaceIds)];
+    // Wait for every queued hydration and persist new details to the cache
+    settle: async (): Promise<PlaceDetails[]> => {
+      const results = await Promise.all(pending);
+      await placeDetailsCache.flush().catch(error => console.error('Error flushing place details cache:', error));
+      return results.filter((place): place is PlaceDetails => place !== null);
+    }
+  };
 }
 
 export async function POST(request: NextRequest) {
@@ -116,7 +154,21 @@ export async function POST(request: NextRequest) {
 
   try {
     const body = await request.json();
-    const { polygon, count } = body;
+    const { polygon, maxApiCalls = DEFAULT_MAX_API_CALLS, hydrate = false } = body;
+
+    const { count } = body;
+    if (count !== undefined && !(typeof count === 'number' && Number.isFinite(count) && count >= 0)) {
+      return NextResponse.json({ error: 'Invalid count. Must be a non-negative number' }, { status: 400 });
+    }
+
+    // Room for at least the root INSIGHT_COUNT and one INSIGHT_PLACES call
+    if (!Number.isInteger(maxApiCalls) || maxApiCalls < 2) {
+      return NextResponse.json({ error: 'Invalid maxApiCalls. Must be an integer of at least 2' }, { status: 400 });
+    }
+
+    if (typeof hydrate !== 'boolean') {
+      return NextResponse.json({ error: 'Invalid hydrate. Must be a boolean' }, { status: 400 });
+    }
 
     // Accept either 4 points or 5 points (closed polygon)
     if (!polygon || !Array.isArray(polygon)) {
@@ -140,16 +192,56 @@ export async function POST(request: NextRequest) {
       lng: p.lng ?? p.longitude
     }));
 
-    console.log(`Starting collection for polygon with initial count: ${count}`);
-
-    const placeIds = await collectPlacesRecursive(points, count, apiKey);
+    // With `hydrate`, place details are fetched as IDs arrive so the two phases overlap
+    const hydration = hydrate ? createHydrationQueue(apiKey) : null;
+    let collected: { placeIds: string[]; truncated: boolean };
+    let places: PlaceDetails[] = [];
+
+    try {
+      collected = await collectPlaces(points, count, apiKey, maxApiCalls, hydration?.add);
+    } catch (error) {
+      // Don't start billed Place Details calls for a response that is never sent
+      if (hydration) hydration.state.stopped = true;
+      throw error;
+    } finally {
+      // Settle hydration first; cache write failures are logged so they never
+      // mask the collection error or drop billed Place Details results
+      if (hydration) places = await hydration.settle();
+      await flushInsightsCache().catch(error => console.error('Error flushing insights cache:', error));
+    }
 
+    const { placeIds, truncated } = collected;
     console.log(`Collected ${placeIds.length} unique place IDs`);
 
+    if (!hydration) {
+      return NextResponse.json({
+        ok: true,
+        placeIds,
+        count: placeIds.length,
+        truncated
+      });
+    }
+
+    console.log(`Hydrated ${places.length} places`);
+
+    if (hydration.state.rateLimitHit) {
+      return NextResponse.json({
+        error: 'Rate limit hit (429 error) while hydrating. Please reduce concurrency or add delays.',
+        rateLimitHit: true,
+        placeIds,
+        count: placeIds.length,
+        truncated,
+        successful: places.length,
+        places
+      }, { status: 429 });
+    }
+
     return NextResponse.json({
       ok: true,
       placeIds,
-      count: placeIds.length
+      count: placeIds.length,
+      truncated,
+      places
     });
 
   } catch (error: unknown) {
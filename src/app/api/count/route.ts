@@ -1,5 +1,6 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { PLACE_TYPES } from '@/config/filters';
+import { Point } from '@/lib/subdivision';
+import { getCount, flushInsightsCache } from '@/lib/insights';
 
 export async function POST(request: NextRequest) {
   const apiKey = process.env.GOOGLE_MAPS_API_KEY;
@@ -20,40 +21,15 @@ export async function POST(request: NextRequest) {
     console.log(`Getting restaurant count for custom polygon...`);
     console.log(`Polygon coordinates:`, polygon);
 
-    const requestBody = {
-      insights: ['INSIGHT_COUNT'],
-      filter: {
-        locationFilter: {
-          customArea: {
-            polygon: {
-              coordinates: polygon
-            }
-          }
-        },
-        typeFilter: { includedTypes: PLACE_TYPES },
-        ratingFilter: { minRating: 4.5, maxRating: 5.0 },
-        operatingStatus: ['OPERATING_STATUS_OPERATIONAL']
-      }
-    };
+    // Drop the closing point and normalize to {lat, lng} for the shared helper
+    // eslint-disable-next-line @typescript-eslint/no-explicit-any
+    const points: Point[] = polygon.slice(0, 4).map((p: any) => ({
+      lat: p.lat ?? p.latitude,
+      lng: p.lng ?? p.longitude
+    }));
 
-    console.log(`Making count API call using custom polygon filter`);
-
-    const googleResponse = await fetch('https://areainsights.googleapis.com/v1:computeInsights', {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-        'X-Goog-Api-Key': apiKey
-      },
-      body: JSON.stringify(requestBody)
-    });
-
-    if (!googleResponse.ok) {
-      const errorText = await googleResponse.text();
-      throw new Error(`Google API error: ${googleResponse.status} - ${errorText}`);
-    }
-
-    const googleData = await googleResponse.json();
-    const count = parseInt(googleData.count || '0');
+    const count = await getCount(points, apiKey);
+    await flushInsightsCache();
     const cost = count * 0.02;
 
     console.log(`Found ${count} restaurants, estimated cost: $${cost}`);
@@ -1,27 +1,11 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { writeFile, readFile } from 'fs/promises';
 import { join } from 'path';
+import { MAX_CONCURRENT_REQUESTS } from '@/lib/google';
+import { hydratePlace, placeDetailsCache, PlaceDetails } from '@/lib/places';
 
-interface PlaceDetails {
-  id: string;
-  name: string;
-  placeId: string;
-  googleMapsUri?: string;
-  primaryType?: string;
-  primaryTypeDisplayName?: string;
-  types?: string[];
-  rating?: number;
-  userRatingCount?: number;
-  priceLevel?: string;
-  priceRange?: Record<string, unknown>;
-  location?: {
-    latitude: number;
-    longitude: number;
-  };
-}
-
-const MAX_WORKERS = 50; // Much more aggressive - Google's default quota is usually 100-1000 QPS
-const BATCH_DELAY = 100; // 100ms delay between batches
+// One worker per slot in the shared Google request limiter - Google's default quota is usually 100-1000 QPS
+const MAX_WORKERS = MAX_CONCURRENT_REQUESTS;
 
 export async function GET(request: NextRequest) {
   const searchParams = request.nextUrl.searchParams;
@@ -84,22 +68,10 @@ export async function GET(request: NextRequest) {
 
     // Hydrate the batch with progress saving
     const saveProgress = async (places: PlaceDetails[], processedCount: number) => {
-      const existingPlaces = existingData.places || [];
-      const allPlaces = [...existingPlaces, ...places];
-      const uniquePlaces = allPlaces.filter((place, index, arr) => 
-        arr.findIndex(p => p.placeId === place.placeId) === index
-      );
-
-      const progressData = {
-        ...existingData,
-        totalPlaces: uniquePlaces.length,
-        places: uniquePlaces,
-        lastHydrated: new Date().toISOString(),
+      await saveCityData(filePath, existingData, places, {
         lastBatchEnd: start + processedCount,
         inProgress: true
-      };
-
-      await writeFile(filePath, JSON.stringify(progressData, null, 2));
+      });
     };
 
     const hydrationResult = await hydratePlaces(batchPlaceIds, apiKey, saveProgress);
@@ -107,28 +79,17 @@ export async function GET(request: NextRequest) {
     // Check if rate limit was hit
     if (hydrationResult.rateLimitHit) {
       // Save what we got so far
-      const existingPlaces = existingData.places || [];
-      const allPlaces = [...existingPlaces, ...hydrationResult.places];
-      const uniquePlaces = allPlaces.filter((place, index, arr) => 
-        arr.findIndex(p => p.placeId === place.placeId) === index
-      );
-
-      const updatedData = {
-        ...existingData,
-        totalPlaces: uniquePlaces.length,
-        places: uniquePlaces,
-        lastHydrated: new Date().toISOString(),
+      const uniquePlaces = await saveCityData(filePath, existingData, hydrationResult.places, {
         lastBatchEnd: hydrationResult.processedCount + start,
         rateLimitHit: true
-      };
-
-      await writeFile(filePath, JSON.stringify(updatedData, null, 2));
+      });
 
       return NextResponse.json({
         error: 'Rate limit hit (429 error). Please reduce concurrency or add delays.',
         rateLimitHit: true,
         processed: hydrationResult.processedCount,
         successful: hydrationResult.places.length,
+        fromCache: hydrationResult.cachedCount,
         totalPlaces: uniquePlaces.length,
         savedSoFar: uniquePlaces.length,
         remainingPlaceIds: unprocessedPlaceIds.length - (hydrationResult.processedCount + start),
@@ -136,31 +97,17 @@ export async function GET(request: NextRequest) {
       }, { status: 429 });
     }
     
-    // Merge with existing places
-    const existingPlaces = existingData.places || [];
-    const allPlaces = [...existingPlaces, ...hydrationResult.places];
-    
-    // Remove duplicates by placeId
-    const uniquePlaces = allPlaces.filter((place, index, arr) => 
-      arr.findIndex(p => p.placeId === place.placeId) === index
-    );
-
-    // Update the file
-    const updatedData = {
-      ...existingData,
-      totalPlaces: uniquePlaces.length,
-      places: uniquePlaces,
-      lastHydrated: new Date().toISOString(),
+    // Merge with existing places and update the file
+    const uniquePlaces = await saveCityData(filePath, existingData, hydrationResult.places, {
       lastBatchEnd: endIndex
-    };
-
-    await writeFile(filePath, JSON.stringify(updatedData, null, 2));
+    });
 
     return NextResponse.json({
       ok: true,
       city,
       processed: batchPlaceIds.length,
       successful: hydrationResult.places.length,
+      fromCache: hydrationResult.cachedCount,
       totalPlaces: uniquePlaces.length,
       totalPlaceIds: placeIds.length,
       skippedExisting: existingPlaceIds.size,
@@ -175,103 +122,122 @@ export async function GET(request: NextRequest) {
   }
 }
 
-async function hydratePlace(placeResourceName: string, apiKey: string): Promise<PlaceDetails | null> {
-  const url = `https://places.googleapis.com/v1/${placeResourceName}`;
-  const fieldMask = "id,name,displayName,googleMapsUri,primaryType,primaryTypeDisplayName,types,rating,userRatingCount,priceLevel,priceRange,location";
-  
-  try {
-    const response = await fetch(url, {
-      headers: {
-        'X-Goog-Api-Key': apiKey,
-        'X-Goog-FieldMask': fieldMask
-      }
-    });
-
-    if (response.status === 404) {
-      return null;
-    }
-
-    if (!response.ok) {
-      throw new Error(`Place details error: ${response.status}`);
+// Merge new places into the city file's list, keeping the first copy of each placeId
+function mergePlaces(existingPlaces: PlaceDetails[], newPlaces: PlaceDetails[]): PlaceDetails[] {
+  const byPlaceId = new Map<string, PlaceDetails>();
+  for (const place of [...existingPlaces, ...newPlaces]) {
+    if (!byPlaceId.has(place.placeId)) {
+      byPlaceId.set(place.placeId, place);
     }
+  }
+  return [...byPlaceId.values()];
+}
 
-    const data = await response.json();
-    
-    return {
-      id: data.id,
-      name: data.displayName?.text || data.displayName || data.name,
-      placeId: data.name,
-      googleMapsUri: data.googleMapsUri,
-      primaryType: data.primaryType,
-      primaryTypeDisplayName: data.primaryTypeDisplayName?.text || data.primaryTypeDisplayName,
-      types: data.types || [],
-      rating: data.rating,
-      userRatingCount: data.userRatingCount,
-      priceLevel: data.priceLevel,
-      priceRange: data.priceRange,
-      location: data.location
-    };
+async function saveCityData(
+  filePath: string,
+  existingData: { places?: PlaceDetails[] },
+  newPlaces: PlaceDetails[],
+  fields: Record<string, unknown>
+): Promise<PlaceDetails[]> {
+  const uniquePlaces = mergePlaces(existingData.places || [], newPlaces);
+
+  const updatedData = {
+    ...existingData,
+    totalPlaces: uniquePlaces.length,
+    places: uniquePlaces,
+    lastHydrated: new Date().toISOString(),
+    ...fields
+  };
 
-  } catch (error) {
-    console.error(`Error hydrating place ${placeResourceName}:`, error);
-    return null;
-  }
+  await writeFile(filePath, JSON.stringify(updatedData, null, 2));
+  return uniquePlaces;
 }
 
 async function hydratePlaces(placeNames: string[], apiKey: string, saveProgressCallback?: (places: PlaceDetails[], processedCount: number) => Promise<void>): Promise<{
   places: PlaceDetails[];
   rateLimitHit: boolean;
   processedCount: number;
+  cachedCount: number;
 }> {
-  const results: PlaceDetails[] = [];
+  // Slot per input so results come back in placeNames order regardless of completion order
+  const slots: (PlaceDetails | null)[] = new Array(placeNames.length).fill(null);
+  const hydrated = () => slots.filter((place): place is PlaceDetails => place !== null);
   const concurrency = MAX_WORKERS;
   let rateLimitHit = false;
-  let processedCount = 0;
-  
-  for (let i = 0; i < placeNames.length; i += concurrency) {
-    if (rateLimitHit) {
-      console.log(`Rate limit hit, stopping hydration. Processed ${results.length} places so far.`);
-      break;
+  let pendingSave = Promise.resolve();
+
+  // Restore cached places up front and only dispatch the misses
+  const toFetch: number[] = [];
+  for (let i = 0; i < placeNames.length; i++) {
+    const cached = await placeDetailsCache.get(placeNames[i]);
+    if (cached) {
+      slots[i] = cached;
+    } else {
+      toFetch.push(i);
     }
-    
-    const batchNum = Math.floor(i/concurrency) + 1;
-    const totalBatches = Math.ceil(placeNames.length/concurrency);
-    const batch = placeNames.slice(i, i + concurrency);
-    console.log(`Processing batch ${batchNum}/${totalBatches} (${batch.length} places) - ${results.length} successful so far`);
-    
-    const promises = batch.map(placeName => hydratePlace(placeName, apiKey));
-    const batchResults = await Promise.allSettled(promises);
-    
-    for (const result of batchResults) {
-      processedCount++;
-      
-      if (result.status === 'rejected' && result.reason?.message?.includes('429')) {
-        console.log(`Rate limit detected (429 error), stopping hydration process`);
-        rateLimitHit = true;
-        break;
+  }
+  const cachedCount = placeNames.length - toFetch.length;
+  console.log(`${cachedCount} places restored from cache`);
+
+  // Progress is the length of the placeNames prefix that is fully cached or
+  // attempted without a 429, so a resume from start + processedCount never skips a place
+  const attempted: boolean[] = new Array(toFetch.length).fill(false);
+  let attemptedPrefix = 0;
+  const processedPrefix = () => {
+    while (attemptedPrefix < toFetch.length && attempted[attemptedPrefix]) attemptedPrefix++;
+    return attemptedPrefix < toFetch.length ? toFetch[attemptedPrefix] : placeNames.length;
+  };
+  let attemptedCount = 0;
+  let nextIndex = 0;
+
+  // Each worker pulls the next place as soon as its previous call finishes,
+  // so one slow response never holds up a whole batch
+  const worker = async () => {
+    while (!rateLimitHit && nextIndex < toFetch.length) {
+      const fetchIndex = nextIndex++;
+      const index = toFetch[fetchIndex];
+      const placeName = placeNames[index];
+
+      let rateLimited = false;
+      try {
+        slots[index] = await hydratePlace(placeName, apiKey);
+      } catch (error) {
+        if (error instanceof Error && error.message.includes('429')) {
+          console.log(`Rate limit detected (429 error), stopping hydration process`);
+          rateLimitHit = true;
+          rateLimited = true;
+        }
       }
-      
-      if (result.status === 'fulfilled' && result.value !== null) {
-        results.push(result.value);
+      // A rate-limited place was never hydrated, so the resume index must stop at it
+      attempted[fetchIndex] = !rateLimited;
+      attemptedCount++;
+
+      // Save progress every `concurrency` completions
+      if (saveProgressCallback && attemptedCount % concurrency === 0) {
+        const snapshot = hydrated();
+        const count = processedPrefix();
+        console.log(`Saving progress: ${snapshot.length} places hydrated so far...`);
+        pendingSave = pendingSave
+          .then(() => saveProgressCallback(snapshot, count))
+          .then(() => placeDetailsCache.flush());
       }
     }
-    
-    // Save progress every batch
-    if (saveProgressCallback) {
-      console.log(`Saving progress: ${results.length} places hydrated so far...`);
-      await saveProgressCallback(results, processedCount);
-    }
-    
-    if (rateLimitHit) break;
-    
-    if (i + concurrency < placeNames.length) {
-      await new Promise(resolve => setTimeout(resolve, BATCH_DELAY));
-    }
+  };
+
+  console.log(`Hydrating ${toFetch.length} places with ${concurrency} workers`);
+  await Promise.all(Array.from({ length: Math.min(concurrency, toFetch.length) }, worker));
+  await pendingSave;
+  await placeDetailsCache.flush();
+
+  const places = hydrated();
+  if (rateLimitHit) {
+    console.log(`Rate limit hit, stopped hydration. Processed ${places.length} places so far.`);
   }
 
   return {
-    places: results,
+    places,
     rateLimitHit,
-    processedCount
+    processedCount: processedPrefix(),
+    cachedCount
   };
 }
\ No newline at end of file
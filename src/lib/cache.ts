@@ -0,0 +1,107 @@
+import { appendFile, mkdir, readFile, rename, writeFile } from 'fs/promises';
+import { join } from 'path';
+
+const CACHE_DIR = join(process.cwd(), '.cache');
+
+type Entry<T> = { value: T; expiresAt: number };
+
+/**
+ * Create a file-backed key/value cache stored as an append-only log in
+ * .cache/<name>.jsonl. Entries expire `ttlMs` after they are set. The log
+ * is replayed once on first access; flush() appends only the entries set
+ * since the last flush, and compacts the log once it is mostly stale.
+ */
+export function createDiskCache<T>(name: string, ttlMs: number) {
+  const filePath = join(CACHE_DIR, `${name}.jsonl`);
+  let entries: Promise<Map<string, Entry<T>>> | null = null;
+  let pending: [string, Entry<T>][] = [];
+  let logLines = 0;
+  // Set when the log on disk has lines we skipped, so the next flush rewrites it
+  let needsCompaction = false;
+  // Set when the log exists but couldn't be read; never overwrite it then
+  let readFailed = false;
+  let flushing = Promise.resolve();
+
+  const load = () => {
+    entries ??= readFile(filePath, 'utf8')
+      .then(content => {
+        const map = new Map<string, Entry<T>>();
+        for (const line of content.split('\n')) {
+          if (!line) continue;
+          try {
+            const [key, entry] = JSON.parse(line) as [string, Entry<T>];
+            map.set(key, entry);
+            logLines++;
+          } catch {
+            // A torn write (e.g. process killed mid-append) only loses that line
+            needsCompaction = true;
+          }
+        }
+        if (content && !content.endsWith('\n')) needsCompaction = true;
+        return map;
+      }, (error: NodeJS.ErrnoException) => {
+        if (error.code !== 'ENOENT') {
+          console.error(`Could not read cache ${filePath}:`, error);
+          readFailed = true;
+        }
+        return new Map<string, Entry<T>>();
+      });
+    return entries;
+  };
+
+  const writeLog = async () => {
+    if (pending.length === 0 && !needsCompaction) return;
+    const map = await load();
+    const records = pending;
+    pending = [];
+
+    try {
+      await mkdir(CACHE_DIR, { recursive: true });
+
+      if (!readFailed && (needsCompaction || logLines + records.length > 2 * map.size)) {
+        // Rewrite with only live entries; rename so a crash never leaves a truncated log
+        const now = Date.now();
+        const live = [...map].filter(([, entry]) => entry.expiresAt >= now);
+        const tmpPath = `${filePath}.${process.pid}.tmp`;
+        await writeFile(tmpPath, live.map(record => JSON.stringify(record) + '\n').join(''));
+        await rename(tmpPath, filePath);
+        logLines = live.length;
+        needsCompaction = false;
+      } else if (records.length > 0) {
+        await appendFile(filePath, records.map(record => JSON.stringify(record) + '\n').join(''));
+        logLines += records.length;
+      }
+    } catch (error) {
+      // Keep the entries so a later flush can retry
+      pending = [...records, ...pending];
+      throw error;
+    }
+  };
+
+  return {
+    async get(key: string): Promise<T | undefined> {
+      const map = await load();
+      const entry = map.get(key);
+      if (!entry) return undefined;
+      if (entry.expiresAt < Date.now()) {
+        map.delete(key);
+        return undefined;
+      }
+      return entry.value;
+    },
+
+    async set(key: string, value: T): Promise<void> {
+      const map = await load();
+      const entry = { value, expiresAt: Date.now() + ttlMs };
+      map.set(key, entry);
+      pending.push([key, entry]);
+    },
+
+    // Flushes run one at a time so appends never interleave with a compaction
+    flush(): Promise<void> {
+      const run = flushing.then(writeLog);
+      flushing = run.catch(() => undefined);
+      return run;
+    }
+  };
+}
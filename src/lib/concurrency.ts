@@ -0,0 +1,27 @@
+// Promise concurrency helpers
+
+/**
+ * Create a semaphore-style limiter: at most `limit` wrapped tasks run
+ * at once, the rest wait in FIFO order for a free slot.
+ */
+export function createLimiter(limit: number) {
+  let active = 0;
+  const waiting: (() => void)[] = [];
+
+  return async function run<T>(task: () => Promise<T>): Promise<T> {
+    if (active >= limit) {
+      await new Promise<void>(resolve => waiting.push(resolve));
+    } else {
+      active++;
+    }
+
+    try {
+      return await task();
+    } finally {
+      // Hand the slot straight to the next waiter, or release it
+      const next = waiting.shift();
+      if (next) next();
+      else active--;
+    }
+  };
+}
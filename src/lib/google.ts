@@ -0,0 +1,50 @@
+// Shared HTTP plumbing for Google Maps Platform calls
+
+import { createLimiter } from '@/lib/concurrency';
+
+export const INSIGHTS_URL = 'https://areainsights.googleapis.com/v1:computeInsights';
+export const PLACES_URL = 'https://places.googleapis.com/v1';
+
+const MAX_RETRIES = 3;
+const BACKOFF_MS = 200;
+const RETRY_STATUSES = new Set([429, 500, 502, 503, 504]);
+
+// Caps in-flight Google requests across every route in this process
+export const MAX_CONCURRENT_REQUESTS = 64;
+const limit = createLimiter(MAX_CONCURRENT_REQUESTS);
+
+// Node's fetch keeps sockets alive in a per-origin pool, so every call to the
+// same host reuses an open TLS connection instead of handshaking again.
+let jsonHeaders: Record<string, string> | null = null;
+
+export function googleHeaders(apiKey: string): Record<string, string> {
+  if (!jsonHeaders || jsonHeaders['X-Goog-Api-Key'] !== apiKey) {
+    jsonHeaders = {
+      'Content-Type': 'application/json',
+      'X-Goog-Api-Key': apiKey
+    };
+  }
+  return jsonHeaders;
+}
+
+/**
+ * fetch() with retry and exponential backoff on 429/5xx responses
+ * and network errors. The last response is returned as-is so callers
+ * can still inspect the status. Requests queue once
+ * MAX_CONCURRENT_REQUESTS are in flight.
+ */
+export async function googleFetch(url: string, init?: RequestInit): Promise<Response> {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const response = await limit(() => fetch(url, init));
+      if (!RETRY_STATUSES.has(response.status) || attempt >= MAX_RETRIES) {
+        return response;
+      }
+      // Drain the body so the socket goes back to the pool
+      await response.body?.cancel();
+    } catch (error) {
+      if (attempt >= MAX_RETRIES) throw error;
+    }
+    await new Promise(resolve => setTimeout(resolve, BACKOFF_MS * 2 ** attempt));
+  }
+}
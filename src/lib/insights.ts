@@ -0,0 +1,80 @@
+import { createHash } from 'crypto';
+import { closePolygon, toGoogleFormat, polygonKey, Point } from '@/lib/subdivision';
+import { PLACE_TYPES } from '@/config/filters';
+import { googleFetch, googleHeaders, INSIGHTS_URL } from '@/lib/google';
+import { createDiskCache } from '@/lib/cache';
+
+const CACHE_TTL_MS = 24 * 60 * 60 * 1000; // 1 day
+
+// Everything in the request except the polygon is fixed, so encode it once
+const STATIC_FILTER_JSON = JSON.stringify({
+  typeFilter: { includedTypes: PLACE_TYPES },
+  ratingFilter: { minRating: 4.5, maxRating: 5.0 },
+  operatingStatus: ['OPERATING_STATUS_OPERATIONAL']
+}).slice(1, -1);
+
+// Keyed by polygonKey so retries and repeated areas reuse billed results; the
+// filter hash in the cache names means changing the filter starts fresh caches
+const filterHash = createHash('sha1').update(STATIC_FILTER_JSON).digest('hex').slice(0, 8);
+const countCache = createDiskCache<number>(`insight_count_${filterHash}`, CACHE_TTL_MS);
+const placeIdsCache = createDiskCache<string[]>(`insight_places_${filterHash}`, CACHE_TTL_MS);
+
+function insightsBody(insight: 'INSIGHT_COUNT' | 'INSIGHT_PLACES', polygon: Point[]): string {
+  const coordinates = JSON.stringify(toGoogleFormat(closePolygon(polygon)));
+  return `{"insights":["${insight}"],"filter":{"locationFilter":{"customArea":{"polygon":{"coordinates":${coordinates}}}},${STATIC_FILTER_JSON}}}`;
+}
+
+async function computeInsights(
+  insight: 'INSIGHT_COUNT' | 'INSIGHT_PLACES',
+  polygon: Point[],
+  apiKey: string
+) {
+  const response = await googleFetch(INSIGHTS_URL, {
+    method: 'POST',
+    headers: googleHeaders(apiKey),
+    body: insightsBody(insight, polygon)
+  });
+
+  if (!response.ok) {
+    const errorText = await response.text();
+    throw new Error(`Google API error: ${response.status} - ${errorText}`);
+  }
+
+  return response.json();
+}
+
+async function fetchCount(polygon: Point[], apiKey: string): Promise<number> {
+  const data = await computeInsights('INSIGHT_COUNT', polygon, apiKey);
+  return parseInt(data.count || '0');
+}
+
+async function fetchPlaceIds(polygon: Point[], apiKey: string): Promise<string[]> {
+  const data = await computeInsights('INSIGHT_PLACES', polygon, apiKey);
+  // Extract place IDs from the response
+  const placeInfos = data.placeInfos || [];
+  return placeInfos.map((info: { place: string }) => info.place);
+}
+
+export async function getCount(polygon: Point[], apiKey: string): Promise<number> {
+  const key = polygonKey(polygon);
+  const cached = await countCache.get(key);
+  if (cached !== undefined) return cached;
+
+  const count = await fetchCount(polygon, apiKey);
+  await countCache.set(key, count);
+  return count;
+}
+
+export async function getPlaceIds(polygon: Point[], apiKey: string): Promise<string[]> {
+  const key = polygonKey(polygon);
+  const cached = await placeIdsCache.get(key);
+  if (cached !== undefined) return cached;
+
+  const placeIds = await fetchPlaceIds(polygon, apiKey);
+  await placeIdsCache.set(key, placeIds);
+  return placeIds;
+}
+
+export async function flushInsightsCache(): Promise<void> {
+  await Promise.all([countCache.flush(), placeIdsCache.flush()]);
+}
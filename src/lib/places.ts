@@ -0,0 +1,81 @@
+import { createHash } from 'crypto';
+import { googleFetch, PLACES_URL } from '@/lib/google';
+import { createDiskCache } from '@/lib/cache';
+
+export interface PlaceDetails {
+  id: string;
+  name: string;
+  placeId: string;
+  googleMapsUri?: string;
+  primaryType?: string;
+  primaryTypeDisplayName?: string;
+  types?: string[];
+  rating?: number;
+  userRatingCount?: number;
+  priceLevel?: string;
+  priceRange?: Record<string, unknown>;
+  location?: {
+    latitude: number;
+    longitude: number;
+  };
+}
+
+// Only fields hydratePlace emits; `id` is derived from the `places/<id>` resource name
+const FIELD_MASK = "name,displayName,googleMapsUri,primaryType,primaryTypeDisplayName,types,rating,userRatingCount,priceLevel,priceRange,location";
+const CACHE_TTL_MS = 7 * 24 * 60 * 60 * 1000; // 7 days
+
+// Keyed by place resource name; the field mask hash in the cache name means
+// changing the mask starts a fresh cache
+const fieldMaskHash = createHash('sha1').update(FIELD_MASK).digest('hex').slice(0, 8);
+export const placeDetailsCache = createDiskCache<PlaceDetails>(`place_details_${fieldMaskHash}`, CACHE_TTL_MS);
+
+export async function hydratePlace(placeResourceName: string, apiKey: string): Promise<PlaceDetails | null> {
+  const url = `${PLACES_URL}/${placeResourceName}`;
+
+  try {
+    const response = await googleFetch(url, {
+      headers: {
+        'X-Goog-Api-Key': apiKey,
+        'X-Goog-FieldMask': FIELD_MASK
+      }
+    });
+
+    if (response.status === 404) {
+      // Discard the unread body so the socket returns to the keep-alive pool
+      await response.body?.cancel();
+      return null;
+    }
+
+    if (!response.ok) {
+      throw new Error(`Place details error: ${response.status}`);
+    }
+
+    const data = await response.json();
+
+    const place: PlaceDetails = {
+      id: data.name.replace(/^places\//, ''),
+      name: data.displayName?.text || data.name,
+      placeId: data.name,
+      googleMapsUri: data.googleMapsUri,
+      primaryType: data.primaryType,
+      primaryTypeDisplayName: data.primaryTypeDisplayName?.text,
+      types: data.types || [],
+      rating: data.rating,
+      userRatingCount: data.userRatingCount,
+      priceLevel: data.priceLevel,
+      priceRange: data.priceRange,
+      location: data.location
+    };
+
+    await placeDetailsCache.set(placeResourceName, place);
+    return place;
+
+  } catch (error) {
+    // Let callers see the rate limit so they can stop early
+    if (error instanceof Error && error.message.includes('429')) {
+      throw error;
+    }
+    console.error(`Error hydrating place ${placeResourceName}:`, error);
+    return null;
+  }
+}
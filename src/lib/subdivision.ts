@@ -28,7 +28,8 @@ function centroid(points: Point[]): Point {
  *   |     |
  *   D --- C
  *
- * Returns 4 smaller quadrilaterals
+ * Returns 4 smaller quadrilaterals. They share edges and exactly tile
+ * the parent, so querying them as polygon filters never covers an area twice.
  */
 export function subdivideQuad(polygon: Point[]): Point[][] {
   if (polygon.length !== 4) {
@@ -64,3 +65,8 @@ export function closePolygon(polygon: Point[]): Point[] {
 export function toGoogleFormat(polygon: Point[]): { latitude: number; longitude: number }[] {
   return polygon.map(p => ({ latitude: p.lat, longitude: p.lng }));
 }
+
+// Canonical cache key for a polygon: vertices rounded to 5 decimals (~1m)
+export function polygonKey(polygon: Point[]): string {
+  return polygon.map(p => `${p.lat.toFixed(5)},${p.lng.toFixed(5)}`).join(';');
+}